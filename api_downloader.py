@@ -5,10 +5,18 @@ Uses the official DeviantArt API with OAuth 2.0 authentication
 Much more reliable than web scraping!
 """
 
+import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-import time
 import re
+import os
+import sys
+import posixpath
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import webbrowser
 from urllib.parse import urlparse, urlencode, parse_qs
 from pathlib import Path
@@ -16,9 +24,51 @@ import base64
 import hashlib
 import secrets
 
+try:
+    import orjson  # Optional, faster JSON encoding/decoding
+except ImportError:
+    orjson = None
+
+# Supported media file extensions
+_VIDEO_EXTS = frozenset({'mp4', 'webm', 'mov', 'avi', 'mkv', 'flv', 'm4v', 'wmv'})
+_IMAGE_EXTS = frozenset({'jpg', 'jpeg', 'png', 'gif', 'webp'})
+
+# Characters not allowed in filenames (including control characters)
+_SANITIZE_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+def _read_json(path):
+    """Read a JSON file, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text())
+
+
+def _write_json(path, data):
+    """Write data as indented JSON, using orjson when available"""
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        path.write_text(json.dumps(data, indent=2))
+
+
+def _path_ext(path):
+    """Get the lowercase file extension (without dot) of a URL path"""
+    return posixpath.splitext(path)[1].lower().lstrip('.')
+
+
+def _guess_ext(path):
+    """Guess file extension from a URL path"""
+    ext = _path_ext(path)
+    if ext == 'jpeg':
+        return 'jpg'
+    if ext in _VIDEO_EXTS or ext in _IMAGE_EXTS:
+        return ext
+    return 'jpg'  # Default
+
 
 class DeviantArtAPIDownloader:
-    def __init__(self):
+    def __init__(self, max_workers=8, page_workers=4, revalidate=False):
         self.client_id = None
         self.client_secret = None
         self.access_token = None
@@ -39,9 +89,41 @@ class DeviantArtAPIDownloader:
         self.download_dir = Path("DeviantArt_API_Downloads")
         self.download_dir.mkdir(exist_ok=True)
 
-        # Keep track of downloaded files
+        # Separate session for media downloads (CDN, no Authorization header),
+        # shared by all download workers
+        self.media_session = requests.Session()
+        self.media_session.headers['User-Agent'] = self.session.headers['User-Agent']
+
+        # Keep-alive connection pools so repeated requests skip the TLS handshake;
+        # sized so every worker can hold its own connection
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        pool_maxsize = max(16, max_workers, page_workers)
+        for session in (self.session, self.media_session):
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retries)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        # Number of parallel download workers and favorites page fetchers
+        self.max_workers = max_workers
+        self.page_workers = page_workers
+
+        # Keep track of downloaded files (shared between download workers)
         self.downloaded_files = set()
         self.failed_downloads = []
+        self.lock = threading.Lock()
+        self.print_lock = threading.Lock()
+
+        # Index of completed downloads: deviation id -> {path, size, etag, last_modified}.
+        # With revalidate enabled, indexed files are re-checked with conditional
+        # requests instead of being skipped outright
+        self.revalidate = revalidate
+        self.index_file = self.download_dir / "download_index.json"
+        self.download_index = self.load_index()
+
+    def log(self, message):
+        """Print a status line without interleaving output from other threads"""
+        with self.print_lock:
+            sys.stdout.write(message + '\n')
 
     def setup_oauth_app(self):
         """Guide user through setting up OAuth application"""
@@ -180,8 +262,7 @@ class DeviantArtAPIDownloader:
         token_data['client_secret'] = self.client_secret
         
         token_file = Path("deviantart_tokens.json")
-        with open(token_file, 'w') as f:
-            json.dump(token_data, f, indent=2)
+        _write_json(token_file, token_data)
         print(f"💾 Tokens and credentials saved to {token_file}")
 
     def load_tokens(self):
@@ -189,8 +270,7 @@ class DeviantArtAPIDownloader:
         token_file = Path("deviantart_tokens.json")
         if token_file.exists():
             try:
-                with open(token_file, 'r') as f:
-                    token_info = json.load(f)
+                token_info = _read_json(token_file)
                 
                 # Load OAuth credentials
                 self.client_id = token_info.get('client_id')
@@ -212,6 +292,34 @@ class DeviantArtAPIDownloader:
         
         return False
 
+    def load_index(self):
+        """Load the index of previously downloaded deviations"""
+        if self.index_file.exists():
+            try:
+                return _read_json(self.index_file)
+            except Exception as e:
+                print(f"⚠ Error loading download index: {e}")
+        return {}
+
+    def save_index(self):
+        """Write the download index atomically"""
+        tmp_file = self.index_file.with_name(self.index_file.name + '.tmp')
+        try:
+            _write_json(tmp_file, self.download_index)
+            os.replace(tmp_file, self.index_file)
+        except Exception as e:
+            print(f"⚠ Error saving download index: {e}")
+
+    def is_indexed(self, deviation_id):
+        """Check if a deviation was already downloaded and is intact on disk"""
+        entry = self.download_index.get(deviation_id)
+        if not entry:
+            return False
+        try:
+            return Path(entry['path']).stat().st_size == entry['size']
+        except (OSError, KeyError):
+            return False
+
     def test_api_access(self):
         """Test API access with current token"""
         try:
@@ -244,50 +352,67 @@ class DeviantArtAPIDownloader:
             if response.status_code == 200:
                 return response.json()
             else:
-                print(f"❌ Failed to get favorites: {response.status_code}")
-                print(f"Response: {response.text}")
+                self.log(f"❌ Failed to get favorites: {response.status_code}")
+                self.log(f"Response: {response.text}")
                 return None
                 
         except Exception as e:
-            print(f"❌ Error getting favorites: {e}")
+            self.log(f"❌ Error getting favorites: {e}")
             return None
 
-    def get_all_favorites(self, username):
-        """Get ALL user's favorites with pagination"""
-        print(f"📥 Fetching all favorites for user: {username}")
+    def iter_all_favorites(self, username):
+        """Yield ALL user's favorites with pagination, as pages arrive"""
+        self.log(f"📥 Fetching all favorites for user: {username}")
         
-        all_deviations = []
+        total_found = 0
         offset = 0
         limit = 24  # Max allowed by API for collections
+        estimated_total = None
         
-        while True:
-            print(f"  Fetching batch {offset//limit + 1} (offset: {offset})...")
-            
-            favorites_data = self.get_user_favorites(username, limit=limit, offset=offset)
-            
-            if not favorites_data:
-                break
-            
-            deviations = favorites_data.get('results', [])
-            
-            if not deviations:
-                print("  No more favorites found")
-                break
-            
-            all_deviations.extend(deviations)
-            print(f"  Found {len(deviations)} favorites in this batch")
-            
-            # Check if there are more
-            has_more = favorites_data.get('has_more', False)
-            if not has_more:
-                print("  Reached end of favorites")
-                break
-            
-            offset += limit
-            time.sleep(0.5)  # Be respectful to the API
+        def fetch_page(page_offset):
+            return self.get_user_favorites(username, limit=limit, offset=page_offset)
+        
+        with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+            # Pages in flight, in offset order
+            pending = deque()
+            try:
+                while True:
+                    # Once the API reports an estimated total, keep up to
+                    # page_workers pages in flight; otherwise fetch one at a time
+                    while not pending or (len(pending) < self.page_workers
+                                          and estimated_total and offset < estimated_total):
+                        self.log(f"  Fetching batch {offset//limit + 1} (offset: {offset})...")
+                        pending.append(executor.submit(fetch_page, offset))
+                        offset += limit
+                    
+                    favorites_data = pending.popleft().result()
+                    
+                    if not favorites_data:
+                        break
+                    
+                    deviations = favorites_data.get('results', [])
+                    
+                    if not deviations:
+                        self.log("  No more favorites found")
+                        break
+                    
+                    total_found += len(deviations)
+                    yield from deviations
+                    self.log(f"  Found {len(deviations)} favorites in this batch")
+                    
+                    # Check if there are more
+                    has_more = favorites_data.get('has_more', False)
+                    if not has_more:
+                        self.log("  Reached end of favorites")
+                        break
+                    
+                    estimated_total = favorites_data.get('estimated_total') or estimated_total
+            finally:
+                # Don't fetch prefetched pages that are no longer needed
+                for future in pending:
+                    future.cancel()
         
-        print(f"🎯 Total favorites found: {len(all_deviations)}")
-        return all_deviations
+        self.log(f"🎯 Total favorites found: {total_found}")
 
     def download_deviation(self, deviation):
         """Download a single deviation (images and videos)"""
@@ -296,7 +421,11 @@ class DeviantArtAPIDownloader:
             author = deviation.get('author', {}).get('username', 'Unknown')
             deviation_id = deviation.get('deviationid', 'unknown')
             
-            print(f"  📥 {title} by {author}")
+            # Skip deviations recorded in the index from a previous run
+            entry = self.download_index.get(deviation_id) if self.is_indexed(deviation_id) else None
+            if entry and not self.revalidate:
+                self.log(f"  ✓ Already downloaded: {title} by {author}")
+                return True
             
             # Try to get the best download URL
             download_url = None
@@ -305,8 +434,8 @@ class DeviantArtAPIDownloader:
             # Method 1: Check if there's a download URL (best quality)
             if 'content' in deviation and 'src' in deviation['content']:
                 download_url = deviation['content']['src']
-                # Check if it's a video based on the URL or file size
-                if any(vid_ext in download_url.lower() for vid_ext in ['.mp4', '.webm', '.mov', '.avi', '.mkv', '.flv', '.m4v', '.wmv']):
+                # Check if it's a video based on the URL extension
+                if _path_ext(urlparse(download_url).path) in _VIDEO_EXTS:
                     content_type = "video"
             
             # Method 2: Check for video-specific content
@@ -322,7 +451,7 @@ class DeviantArtAPIDownloader:
             # Method 3: Try preview URLs (if download not available)
             elif 'preview' in deviation and 'src' in deviation['preview']:
                 download_url = deviation['preview']['src']
-                if any(vid_ext in download_url.lower() for vid_ext in ['.mp4', '.webm', '.mov']):
+                if _path_ext(urlparse(download_url).path) in _VIDEO_EXTS:
                     content_type = "video"
             
             # Method 4: Try thumbs as last resort
@@ -333,8 +462,9 @@ class DeviantArtAPIDownloader:
                     download_url = thumbs[-1].get('src')  # Last one is usually largest
             
             if not download_url:
-                print(f"    ❌ No download URL found")
-                self.failed_downloads.append(f"{title} by {author}")
+                self.log(f"  ❌ No download URL found: {title} by {author}")
+                with self.lock:
+                    self.failed_downloads.append(f"{title} by {author}")
                 return False
             
             # Create filename
@@ -343,89 +473,103 @@ class DeviantArtAPIDownloader:
             full_filename = f"{filename}.{file_ext}"
             file_path = self.download_dir / full_filename
             
+            # Revalidate indexed files with a conditional request
+            headers = {}
+            if entry and entry['path'] == str(file_path):
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            
             # Skip if already downloaded
-            if file_path.exists():
-                print(f"    ✓ Already exists")
+            if file_path.exists() and not headers:
+                self.log(f"  ✓ Already exists: {full_filename}")
+                # Index files from older runs so later runs can skip them early
+                with self.lock:
+                    self.download_index[deviation_id] = {
+                        'path': str(file_path),
+                        'size': file_path.stat().st_size,
+                    }
                 return True
             
             # Download the file
             content_emoji = "🎬" if content_type == "video" else "📥"
-            print(f"    {content_emoji} Downloading: {full_filename}")
-            
-            # Remove authorization header for media download
-            headers = dict(self.session.headers)
-            if 'Authorization' in headers:
-                del headers['Authorization']
+            action = "Checking" if headers else "Downloading"
+            self.log(f"  {content_emoji} {action}: {full_filename}")
             
             # Use longer timeout for videos
             timeout = 60 if content_type == "video" else 30
             
-            response = requests.get(download_url, headers=headers, stream=True, timeout=timeout)
+            response = self.media_session.get(download_url, headers=headers, stream=True, timeout=timeout)
             
-            if response.status_code == 200:
-                with open(file_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
+            if response.status_code == 304:
+                response.close()
+                self.log(f"  ✓ Not modified: {full_filename}")
+                return True
+            elif response.status_code == 200:
+                # Write to a staging file so an interrupted download never
+                # looks complete on the next run
+                part_path = file_path.with_name(file_path.name + '.part')
+                try:
+                    with open(part_path, 'wb', buffering=1 << 20) as f:
+                        for chunk in response.iter_content(chunk_size=1 << 18):
+                            f.write(chunk)
+                        
+                        # The file is not read back, so hint the kernel to drop its
+                        # cached pages. Only pages already written back are dropped;
+                        # dirty pages are skipped rather than synced, so the worker
+                        # never waits on the disk
+                        if hasattr(os, 'posix_fadvise'):
+                            try:
+                                f.flush()
+                                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                            except OSError:
+                                pass
+                    os.replace(part_path, file_path)
+                except BaseException:
+                    try:
+                        part_path.unlink()
+                    except OSError:
+                        pass
+                    raise
                 
                 file_size = file_path.stat().st_size
                 size_mb = file_size / (1024 * 1024)
                 if content_type == "video":
-                    print(f"    ✅ Downloaded video: {size_mb:.1f} MB")
+                    self.log(f"  ✅ Downloaded video: {full_filename} ({size_mb:.1f} MB)")
                 else:
-                    print(f"    ✅ Downloaded: {file_size:,} bytes")
-                self.downloaded_files.add(full_filename)
+                    self.log(f"  ✅ Downloaded: {full_filename} ({file_size:,} bytes)")
+                with self.lock:
+                    self.downloaded_files.add(full_filename)
+                    self.download_index[deviation_id] = {
+                        'path': str(file_path),
+                        'size': file_size,
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                    }
                 return True
             else:
-                print(f"    ❌ Download failed: HTTP {response.status_code}")
-                self.failed_downloads.append(f"{title} by {author}")
+                self.log(f"  ❌ Download failed: {title} by {author} (HTTP {response.status_code})")
+                with self.lock:
+                    self.failed_downloads.append(f"{title} by {author}")
                 return False
                 
         except Exception as e:
-            print(f"    ❌ Error downloading: {e}")
             title = deviation.get('title', 'Unknown')
             author = deviation.get('author', {}).get('username', 'Unknown')
-            self.failed_downloads.append(f"{title} by {author}")
+            self.log(f"  ❌ Error downloading {title} by {author}: {e}")
+            with self.lock:
+                self.failed_downloads.append(f"{title} by {author}")
             return False
 
     def sanitize_filename(self, filename):
         """Create a safe filename"""
-        # Remove invalid characters
-        safe_filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-        return safe_filename[:200]  # Limit length
+        # Remove invalid characters and limit length
+        return _SANITIZE_RE.sub('_', filename)[:200]
 
     def guess_file_extension(self, url):
         """Guess file extension from URL"""
-        parsed = urlparse(url)
-        path = parsed.path.lower()
-        
-        # Image formats
-        if '.jpg' in path or '.jpeg' in path:
-            return 'jpg'
-        elif '.png' in path:
-            return 'png'
-        elif '.gif' in path:
-            return 'gif'
-        elif '.webp' in path:
-            return 'webp'
-        # Video formats
-        elif '.mp4' in path:
-            return 'mp4'
-        elif '.webm' in path:
-            return 'webm'
-        elif '.mov' in path:
-            return 'mov'
-        elif '.avi' in path:
-            return 'avi'
-        elif '.mkv' in path:
-            return 'mkv'
-        elif '.flv' in path:
-            return 'flv'
-        elif '.m4v' in path:
-            return 'm4v'
-        elif '.wmv' in path:
-            return 'wmv'
-        else:
-            return 'jpg'  # Default
+        return _guess_ext(urlparse(url).path)
 
     def download_all_favorites(self, username):
         """Main function to download all favorites"""
@@ -433,29 +577,41 @@ class DeviantArtAPIDownloader:
         print(f"📁 Download directory: {self.download_dir.absolute()}")
         print("=" * 80)
         
-        # Get all favorites
-        all_favorites = self.get_all_favorites(username)
-        
-        if not all_favorites:
-            print("❌ No favorites found or error occurred")
-            return
-        
-        print(f"\n🎯 Processing {len(all_favorites)} favorites...")
-        print("=" * 80)
-        
-        # Download each favorite
-        for i, deviation in enumerate(all_favorites):
-            print(f"\n[{i+1}/{len(all_favorites)}]", end=" ")
-            self.download_deviation(deviation)
-            
-            # Small delay to be respectful
-            time.sleep(0.5)
+        # Download favorites in parallel while pages are still being fetched;
+        # rate limiting (429) is handled by the retry policy on the sessions
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                try:
+                    # Map each future to its deviation for progress reporting
+                    futures = {executor.submit(self.download_deviation, deviation): deviation
+                               for deviation in self.iter_all_favorites(username)}
+                    
+                    if not futures:
+                        self.log("❌ No favorites found or error occurred")
+                        return
+                    
+                    self.log(f"\n🎯 Processing {len(futures)} favorites...")
+                    self.log("=" * 80)
+                    
+                    for i, future in enumerate(as_completed(futures)):
+                        deviation = futures[future]
+                        status = "✅" if future.result() else "❌"
+                        title = deviation.get('title', 'Unknown')
+                        author = deviation.get('author', {}).get('username', 'Unknown')
+                        self.log(f"[{i+1}/{len(futures)}] {status} {title} by {author}")
+                except BaseException:
+                    # On Ctrl-C, drop queued downloads instead of finishing them
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+        finally:
+            # Persist the index once, even if the run is interrupted
+            self.save_index()
         
         # Print summary
         print(f"\n" + "=" * 80)
         print(f"📊 DOWNLOAD SUMMARY")
         print(f"=" * 80)
-        print(f"Total favorites: {len(all_favorites)}")
+        print(f"Total favorites: {len(futures)}")
         print(f"Successfully downloaded: {len(self.downloaded_files)}")
         print(f"Failed downloads: {len(self.failed_downloads)}")
         
@@ -472,14 +628,34 @@ class DeviantArtAPIDownloader:
             print(f"🎉 Successfully downloaded {len(self.downloaded_files)} images and videos!")
 
 
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Download DeviantArt favorites using the official API")
+    parser.add_argument('--workers', type=int, default=8, metavar='N',
+                        help="number of parallel media downloads (default: 8)")
+    parser.add_argument('--page-workers', type=int, default=4, metavar='N',
+                        help="number of favorites pages fetched in parallel (default: 4)")
+    parser.add_argument('--revalidate', action='store_true',
+                        help="re-check previously downloaded files with conditional requests "
+                             "and re-download the ones that changed")
+    args = parser.parse_args()
+    
+    if args.workers < 1 or args.page_workers < 1:
+        parser.error("--workers and --page-workers must be at least 1")
+    return args
+
+
 def main():
+    args = parse_args()
+    
     print("🎨 Official DeviantArt API Favorites Downloader")
     print("=" * 80)
     print("Using the official DeviantArt API with OAuth 2.0")
     print("Much more reliable than web scraping!")
     print()
     
-    downloader = DeviantArtAPIDownloader()
+    downloader = DeviantArtAPIDownloader(max_workers=args.workers, page_workers=args.page_workers,
+                                         revalidate=args.revalidate)
     
     # Try to load saved tokens and credentials
     tokens_loaded = downloader.load_tokens()